@@ -0,0 +1,196 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+event_join_policy_enum = postgresql.ENUM("OPEN", "APPROVAL", "OPEN_UNTIL_CAPACITY_THEN_APPROVAL", name="event_join_policy_enum")
+event_status_enum = postgresql.ENUM("DRAFT", "PUBLISHED", "CANCELED", name="event_status_enum")
+participation_status_enum = postgresql.ENUM("APPROVED", "PENDING", "REJECTED", "CANCELED", name="participation_status_enum")
+ride_mode_enum = postgresql.ENUM("NONE", "NEED", "OFFER", name="ride_mode_enum")
+ride_match_status_enum = postgresql.ENUM("PROPOSED", "ACCEPTED", "REJECTED", "CANCELED", name="ride_match_status_enum")
+
+# frozen copy of app/views.py's DDL as of this revision, so later edits there don't change it
+_EVENT_STATS_MV_DDL = [
+    """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS event_stats_mv AS
+    SELECT
+        e.id AS event_id,
+        count(ep.id) FILTER (WHERE ep.status = 'APPROVED')::int AS approved_count,
+        count(ep.id) FILTER (WHERE ep.status = 'PENDING')::int AS pending_count,
+        count(ep.id) FILTER (WHERE ep.status = 'REJECTED')::int AS rejected_count,
+        count(ep.id) FILTER (WHERE ep.status = 'CANCELED')::int AS canceled_count,
+        count(ep.id) FILTER (WHERE ep.status = 'APPROVED' AND ep.ride_mode = 'NEED')::int AS need_ride_count,
+        count(ep.id) FILTER (WHERE ep.status = 'APPROVED' AND ep.ride_mode = 'OFFER')::int AS offer_ride_count,
+        coalesce(sum(ep.seats_offered) FILTER (WHERE ep.status = 'APPROVED' AND ep.ride_mode = 'OFFER'), 0)::int AS seats_offered_total,
+        coalesce(max(m.accepted), 0)::int AS seats_accepted_total,
+        count(ep.id) FILTER (
+            WHERE ep.status = 'APPROVED' AND ep.ride_mode = 'NEED'
+            AND NOT EXISTS (
+                SELECT 1 FROM ride_matches rm
+                WHERE rm.event_id = e.id AND rm.status = 'ACCEPTED' AND rm.rider_participant_id = ep.id
+            )
+        )::int AS unmatched_riders_count
+    FROM events e
+    LEFT JOIN event_participants ep ON ep.event_id = e.id
+    LEFT JOIN (
+        SELECT event_id, count(*) AS accepted
+        FROM ride_matches
+        WHERE status = 'ACCEPTED'
+        GROUP BY event_id
+    ) m ON m.event_id = e.id
+    GROUP BY e.id
+    """,
+    # unique index is required for REFRESH ... CONCURRENTLY
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_event_stats_mv_event ON event_stats_mv (event_id)",
+]
+
+
+def _timestamps():
+    return [
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    ]
+
+
+def _has_create_all_schema() -> bool:
+    # databases created by the app's old create_all() at startup already have the tables
+    if context.is_offline_mode():
+        return False
+    return sa.inspect(op.get_bind()).has_table("events")
+
+
+def _adopt_create_all_schema() -> None:
+    # bring a create_all()-built schema up to this revision instead of re-creating it:
+    # primary keys now default server-side, the two participant indexes were folded
+    # into one covering index, and the stats view is new
+    for table in ("users", "events", "event_participants", "ride_matches"):
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT gen_random_uuid()")
+    op.execute("DROP INDEX IF EXISTS idx_participants_event_status")
+    op.execute("DROP INDEX IF EXISTS idx_participants_event_ride")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_participants_event_status_cover "
+        "ON event_participants (event_id, status) INCLUDE (ride_mode, seats_offered)"
+    )
+    for ddl in _EVENT_STATS_MV_DDL:
+        op.execute(ddl)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto")
+    if _has_create_all_schema():
+        _adopt_create_all_schema()
+        return
+
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Uuid(), server_default=sa.func.gen_random_uuid(), nullable=False),
+        sa.Column("full_name", sa.Text(), nullable=False),
+        sa.Column("email", sa.Text(), nullable=False),
+        sa.Column("phone", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("email"),
+    )
+
+    op.create_table(
+        "events",
+        sa.Column("id", sa.Uuid(), server_default=sa.func.gen_random_uuid(), nullable=False),
+        sa.Column("created_by_id", sa.Uuid(), nullable=False),
+        sa.Column("madrich", sa.Uuid(), nullable=False),
+        sa.Column("title", sa.Text(), nullable=False),
+        sa.Column("description", sa.Text(), nullable=True),
+        sa.Column("start_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("end_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("location_name", sa.Text(), nullable=False),
+        sa.Column("location_lat", sa.Float(), nullable=True),
+        sa.Column("location_lng", sa.Float(), nullable=True),
+        sa.Column("capacity", sa.Integer(), nullable=True),
+        sa.Column("join_policy", event_join_policy_enum, nullable=False),
+        sa.Column("status", event_status_enum, server_default="DRAFT", nullable=False),
+        *_timestamps(),
+        sa.PrimaryKeyConstraint("id"),
+        sa.ForeignKeyConstraint(["created_by_id"], ["users.id"]),
+        sa.ForeignKeyConstraint(["madrich"], ["users.id"]),
+    )
+    op.create_index("idx_events_start_at", "events", ["start_at"])
+    op.create_index("ix_events_created_by_id", "events", ["created_by_id"])
+    op.create_index("ix_events_madrich", "events", ["madrich"])
+
+    op.create_table(
+        "event_participants",
+        sa.Column("id", sa.Uuid(), server_default=sa.func.gen_random_uuid(), nullable=False),
+        sa.Column("event_id", sa.Uuid(), nullable=False),
+        sa.Column("user_id", sa.Uuid(), nullable=False),
+        sa.Column("status", participation_status_enum, nullable=False),
+        sa.Column("ride_mode", ride_mode_enum, server_default="NONE", nullable=False),
+        sa.Column("seats_offered", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("pickup_area", sa.Text(), nullable=True),
+        sa.Column("notes", sa.Text(), nullable=True),
+        *_timestamps(),
+        sa.PrimaryKeyConstraint("id"),
+        sa.ForeignKeyConstraint(["event_id"], ["events.id"]),
+        sa.UniqueConstraint("event_id", "user_id", name="uq_event_user"),
+        sa.CheckConstraint(
+            "((ride_mode = 'OFFER' AND seats_offered >= 1) OR (ride_mode <> 'OFFER' AND seats_offered = 0))",
+            name="chk_offer_seats",
+        ),
+    )
+    op.create_index("ix_event_participants_event_id", "event_participants", ["event_id"])
+    op.create_index("ix_event_participants_user_id", "event_participants", ["user_id"])
+    op.create_index(
+        "idx_participants_event_status_cover", "event_participants", ["event_id", "status"],
+        postgresql_include=["ride_mode", "seats_offered"],
+    )
+
+    op.create_table(
+        "ride_matches",
+        sa.Column("id", sa.Uuid(), server_default=sa.func.gen_random_uuid(), nullable=False),
+        sa.Column("event_id", sa.Uuid(), nullable=False),
+        sa.Column("driver_participant_id", sa.Uuid(), nullable=False),
+        sa.Column("rider_participant_id", sa.Uuid(), nullable=False),
+        sa.Column("status", ride_match_status_enum, server_default="PROPOSED", nullable=False),
+        sa.Column("created_by", sa.Uuid(), nullable=False),
+        *_timestamps(),
+        sa.PrimaryKeyConstraint("id"),
+        sa.ForeignKeyConstraint(["event_id"], ["events.id"]),
+        sa.ForeignKeyConstraint(["driver_participant_id"], ["event_participants.id"]),
+        sa.ForeignKeyConstraint(["rider_participant_id"], ["event_participants.id"]),
+        sa.CheckConstraint("driver_participant_id <> rider_participant_id", name="chk_driver_not_rider"),
+    )
+    op.create_index("ix_ride_matches_event_id", "ride_matches", ["event_id"])
+    op.create_index("ix_ride_matches_driver_participant_id", "ride_matches", ["driver_participant_id"])
+    op.create_index("ix_ride_matches_rider_participant_id", "ride_matches", ["rider_participant_id"])
+    op.create_index("ix_ride_matches_created_by", "ride_matches", ["created_by"])
+    op.create_index("idx_matches_event_status", "ride_matches", ["event_id", "status"])
+
+    for ddl in _EVENT_STATS_MV_DDL:
+        op.execute(ddl)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS event_stats_mv")
+    op.drop_table("ride_matches")
+    op.drop_table("event_participants")
+    op.drop_table("events")
+    op.drop_table("users")
+    for enum in (
+        ride_match_status_enum, ride_mode_enum, participation_status_enum,
+        event_status_enum, event_join_policy_enum,
+    ):
+        op.execute(f"DROP TYPE IF EXISTS {enum.name}")
@@ -0,0 +1,44 @@
+"""event_participants.seats_taken
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "event_participants",
+        sa.Column("seats_taken", sa.Integer(), server_default="0", nullable=False),
+    )
+    # backfill from the matches already accepted
+    op.execute(
+        """
+        UPDATE event_participants ep
+        SET seats_taken = m.accepted
+        FROM (
+            SELECT driver_participant_id, count(*) AS accepted
+            FROM ride_matches
+            WHERE status = 'ACCEPTED'
+            GROUP BY driver_participant_id
+        ) m
+        WHERE m.driver_participant_id = ep.id
+        """
+    )
+    op.create_check_constraint("chk_seats_taken", "event_participants", "seats_taken >= 0")
+
+
+def downgrade() -> None:
+    op.drop_constraint("chk_seats_taken", "event_participants", type_="check")
+    op.drop_column("event_participants", "seats_taken")
@@ -0,0 +1,27 @@
+"""ride suggestion index
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "idx_participants_event_ride_status", "event_participants",
+        ["event_id", "ride_mode", "status", "created_at"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("idx_participants_event_ride_status", table_name="event_participants")
@@ -0,0 +1,57 @@
+"""one active ride match per pair
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-15 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # cancel existing duplicates first, keeping an accepted match over a proposed one, then the oldest
+    op.execute(
+        """
+        WITH ranked AS (
+            SELECT id, row_number() OVER (
+                PARTITION BY event_id, driver_participant_id, rider_participant_id
+                ORDER BY (status = 'ACCEPTED') DESC, created_at, id
+            ) AS rn
+            FROM ride_matches
+            WHERE status IN ('PROPOSED', 'ACCEPTED')
+        )
+        UPDATE ride_matches
+        SET status = 'CANCELED', updated_at = now()
+        FROM ranked
+        WHERE ranked.id = ride_matches.id AND ranked.rn > 1
+        """
+    )
+    # canceled duplicates may have been accepted: recount the drivers' seats
+    op.execute(
+        """
+        UPDATE event_participants ep
+        SET seats_taken = (
+            SELECT count(*) FROM ride_matches rm
+            WHERE rm.driver_participant_id = ep.id AND rm.status = 'ACCEPTED'
+        )
+        WHERE ep.seats_taken > 0
+        """
+    )
+    op.create_index(
+        "uq_matches_active_pair", "ride_matches",
+        ["event_id", "driver_participant_id", "rider_participant_id"],
+        unique=True, postgresql_where=sa.text("status IN ('PROPOSED', 'ACCEPTED')"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("uq_matches_active_pair", table_name="ride_matches")
@@ -0,0 +1,62 @@
+import os
+import time
+from uuid import UUID
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Per-process TTL cache for event stats. Each worker keeps its own copy;
+# for multi-worker deployments swap this for Redis (SET key value EX ttl).
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "5"))
+STATS_CACHE_MAXSIZE = int(os.getenv("STATS_CACHE_MAXSIZE", "10000"))
+
+_stats: dict[UUID, tuple[float, dict]] = {}
+# event_id -> when this worker last wrote to it (see recently_invalidated)
+_invalidated: dict[UUID, float] = {}
+
+def get_stats(event_id: UUID) -> dict | None:
+    hit = _stats.get(event_id)
+    if hit is None:
+        return None
+    expires_at, value = hit
+    if expires_at < time.monotonic():
+        _stats.pop(event_id, None)
+        return None
+    return value
+
+def put_stats(event_id: UUID, value: dict):
+    if STATS_CACHE_TTL <= 0:
+        return
+    if event_id not in _stats and len(_stats) >= STATS_CACHE_MAXSIZE:
+        # drop the oldest entry (dicts keep insertion order)
+        _stats.pop(next(iter(_stats)), None)
+    _stats[event_id] = (time.monotonic() + STATS_CACHE_TTL, value)
+
+def invalidate_stats(event_id: UUID):
+    _stats.pop(event_id, None)
+    if event_id not in _invalidated and len(_invalidated) >= STATS_CACHE_MAXSIZE:
+        _invalidated.pop(next(iter(_invalidated)), None)
+    _invalidated[event_id] = time.monotonic()
+
+def recently_invalidated(event_id: UUID, within: float) -> bool:
+    # true if this worker changed the event in the last `within` seconds
+    at = _invalidated.get(event_id)
+    if at is None:
+        return False
+    if at + within < time.monotonic():
+        _invalidated.pop(event_id, None)
+        return False
+    return True
+
+def invalidate_stats_on_commit(session, event_id: UUID):
+    # invalidating before COMMIT lets a concurrent read re-cache pre-commit numbers
+    # for a full TTL; queue it on the session and drop the entry once the commit lands
+    session.info.setdefault("stale_stats", set()).add(event_id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_stats(session):
+    for event_id in session.info.pop("stale_stats", ()):
+        invalidate_stats(event_id)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_stale_stats(session):
+    session.info.pop("stale_stats", None)
\ No newline at end of file
@@ -1,43 +1,57 @@
+import asyncio
 from uuid import UUID
-from fastapi import FastAPI, Depends, HTTPException
-from sqlmodel import Session, select
-from sqlalchemy import text
+from fastapi import FastAPI, Body, Depends, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import tuple_
 from sqlalchemy.orm import selectinload
 from contextlib import asynccontextmanager
 
-from app.db import get_session, init_db, engine
+from app.db import get_session, init_db, warm_pool, engine
 from app.deps import get_current_user_id
+from app.pagination import encode_cursor, decode_cursor
+from app.views import refresh_event_stats_forever
 from app.models import Event
 from app.enums import EventStatus, ParticipationStatus
 from app.schemas import (
     EventCreate, JoinEvent, UpdateMyParticipation,
-    RideMatchCreate, RideMatchUpdate, OrganizerParticipantOut, EventStatsOut
+    RideMatchCreate, RideMatchUpdate, OrganizerParticipantOut, EventStatsOut, EventListOut,
+    EventListAdapter, OrganizerParticipantListAdapter,
 )
 from app.services.participants import join_event, leave_event, update_my_participation
-from app.services.rides import create_match, update_match_status, list_matches, suggestions
-from app.services.organizer import list_participants, set_participant_status, event_stats
+from app.services.rides import create_match, create_matches, update_match_status, list_matches, export_matches, suggestions
+from app.services.organizer import list_participants, export_participants, set_participant_status, event_stats
 
 #app = FastAPI(title="Event + Rides (SQLModel)")
 
+def _json_page(adapter, rows, next_cursor: str | None) -> Response:
+    # validate + serialize the whole page in one pydantic-core call instead of
+    # FastAPI's per-item response_model round-trip (response_model stays for the docs)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    body = adapter.dump_json(adapter.validate_python(rows))
+    return Response(body, media_type="application/json", headers=headers)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    # Option A (dev): auto create tables
-    init_db()
+    # Option A (dev only, AUTO_CREATE_DB=true): auto create tables; otherwise run `alembic upgrade head` on deploy
+    await init_db()
+
+    # Option B (always useful): verify DB is reachable + pre-open pool connections
+    await warm_pool()
 
-    # Option B (always useful): verify DB is reachable
-    with Session(engine) as session:
-        session.exec(text("SELECT 1"))
+    stats_refresher = asyncio.create_task(refresh_event_stats_forever(engine))
 
     yield
 
     # ---- Shutdown ----
-    # nothing yet (place for cache close, redis, etc.)
+    stats_refresher.cancel()
 
-app = FastAPI(title="Event + Rides (SQLModel)", lifespan=lifespan)
+app = FastAPI(title="Event + Rides (SQLModel)", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 @app.post("/events")
-def create_event(payload: EventCreate, session: Session = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
+async def create_event(payload: EventCreate, session: AsyncSession = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
     e = Event(
         created_by_id=payload.created_by_id,
         title=payload.title,
@@ -52,120 +66,159 @@ def create_event(payload: EventCreate, session: Session = Depends(get_session),
         status=EventStatus.DRAFT,
     )
     session.add(e)
-    session.commit()
-    session.refresh(e)
+    await session.commit()
     return e
 
 @app.post("/events/{event_id}/publish")
-def publish_event(event_id: UUID, session: Session = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
-    e = session.exec(select(Event).where(Event.id == event_id)).one_or_none()
+async def publish_event(event_id: UUID, session: AsyncSession = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
+    e = await session.get(Event, event_id)
     if not e:
         raise HTTPException(404, "Event not found")
     if e.created_by_id != user_id:
         raise HTTPException(403, "Forbidden")
     e.status = EventStatus.PUBLISHED
     session.add(e)
-    session.commit()
-    session.refresh(e)
+    await session.commit()
     return e
 
-@app.get("/events")
-def list_events(session: Session = Depends(get_session)):
+@app.get("/events", response_model=list[EventListOut])
+async def list_events(
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    session: AsyncSession = Depends(get_session),
+):
+    # plain column rows, no ORM instances to build for a read-only list
     stmt = (
-        select(Event)
+        select(Event.id, Event.title, Event.start_at, Event.location_name, Event.status)
         #.options(selectinload(Event.created_by_id))   # eager load creator
-        .order_by(Event.start_at.asc())
+        .order_by(Event.start_at.asc(), Event.id.asc())
+        .limit(limit)
     )
-    return session.exec(stmt).all()
+    after = decode_cursor(cursor)
+    if after:
+        stmt = stmt.where(tuple_(Event.start_at, Event.id) > after)
+    rows = (await session.exec(stmt)).mappings().all()
+    next_cursor = encode_cursor(rows[-1]["start_at"], rows[-1]["id"]) if len(rows) == limit else None
+    return _json_page(EventListAdapter, rows, next_cursor)
 @app.get("/events/{event_id}")
-def get_event(event_id: UUID, session: Session = Depends(get_session)):
-    e = session.exec(select(Event).where(Event.id == event_id)).one_or_none()
+async def get_event(event_id: UUID, session: AsyncSession = Depends(get_session)):
+    e = await session.get(Event, event_id)
     if not e:
         raise HTTPException(404, "Event not found")
     return e
 
 # ----- Participation -----
 @app.post("/events/{event_id}/join")
-def api_join(event_id: UUID, payload: JoinEvent, session: Session = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
-    with session.begin():
-        p = join_event(session, event_id, user_id, payload.ride_mode, payload.seats_offered, payload.pickup_area, payload.notes)
-    session.refresh(p)
+async def api_join(event_id: UUID, payload: JoinEvent, session: AsyncSession = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
+    async with session.begin():
+        p = await join_event(session, event_id, user_id, payload.ride_mode, payload.seats_offered, payload.pickup_area, payload.notes)
     return p
 
 @app.post("/events/{event_id}/leave")
-def api_leave(event_id: UUID, session: Session = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
-    with session.begin():
-        p = leave_event(session, event_id, user_id)
-    session.refresh(p)
+async def api_leave(event_id: UUID, session: AsyncSession = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
+    async with session.begin():
+        p = await leave_event(session, event_id, user_id)
     return p
 
 @app.patch("/events/{event_id}/participants/me")
-def api_update_me(event_id: UUID, payload: UpdateMyParticipation, session: Session = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
-    with session.begin():
-        p = update_my_participation(session, event_id, user_id, payload.ride_mode, payload.seats_offered, payload.pickup_area, payload.notes)
-    session.refresh(p)
+async def api_update_me(event_id: UUID, payload: UpdateMyParticipation, session: AsyncSession = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
+    async with session.begin():
+        p = await update_my_participation(session, event_id, user_id, payload.ride_mode, payload.seats_offered, payload.pickup_area, payload.notes)
     return p
 
 # ----- Rides -----
 @app.get("/events/{event_id}/rides/matches")
-def api_list_matches(event_id: UUID, session: Session = Depends(get_session)):
-    return list_matches(session, event_id)
+async def api_list_matches(
+    event_id: UUID,
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    session: AsyncSession = Depends(get_session),
+):
+    matches = await list_matches(session, event_id, limit, decode_cursor(cursor))
+    if len(matches) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(matches[-1]["created_at"], matches[-1]["id"])
+    return matches
+
+@app.get("/events/{event_id}/rides/matches/export")
+async def api_export_matches(event_id: UUID, session: AsyncSession = Depends(get_session)):
+    lines = await export_matches(session, event_id)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
 
 @app.post("/events/{event_id}/rides/suggestions")
-def api_suggestions(event_id: UUID, session: Session = Depends(get_session)):
-    return suggestions(session, event_id)
+async def api_suggestions(event_id: UUID, session: AsyncSession = Depends(get_session)):
+    return await suggestions(session, event_id)
 
 @app.post("/events/{event_id}/rides/matches")
-def api_create_match(event_id: UUID, payload: RideMatchCreate, session: Session = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
-    with session.begin():
-        m = create_match(session, event_id, user_id, payload.driver_participant_id, payload.rider_participant_id)
-    session.refresh(m)
+async def api_create_match(event_id: UUID, payload: RideMatchCreate, session: AsyncSession = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
+    async with session.begin():
+        m = await create_match(session, event_id, user_id, payload.driver_participant_id, payload.rider_participant_id)
     return m
 
+@app.post("/events/{event_id}/rides/matches/bulk")
+async def api_create_matches(event_id: UUID, payload: list[RideMatchCreate] = Body(..., max_length=500), session: AsyncSession = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
+    async with session.begin():
+        matches = await create_matches(
+            session, event_id, user_id,
+            [(p.driver_participant_id, p.rider_participant_id) for p in payload],
+        )
+    return matches
+
 @app.patch("/rides/matches/{match_id}")
-def api_update_match(match_id: UUID, payload: RideMatchUpdate, session: Session = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
-    with session.begin():
-        m = update_match_status(session, match_id, user_id, payload.status)
-    session.refresh(m)
+async def api_update_match(match_id: UUID, payload: RideMatchUpdate, session: AsyncSession = Depends(get_session), user_id: UUID = Depends(get_current_user_id)):
+    async with session.begin():
+        m = await update_match_status(session, match_id, user_id, payload.status)
     return m
 
 # ----- Organizer: participants list -----
 @app.get("/events/{event_id}/participants", response_model=list[OrganizerParticipantOut])
-def api_list_participants(
+async def api_list_participants(
+    event_id: UUID,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    session: AsyncSession = Depends(get_session),
+    user_id: UUID = Depends(get_current_user_id),
+):
+    rows = await list_participants(session, event_id, user_id, limit, decode_cursor(cursor))
+    next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"]) if len(rows) == limit else None
+    return _json_page(OrganizerParticipantListAdapter, rows, next_cursor)
+
+# ----- Organizer: participants export (NDJSON, streamed) -----
+@app.get("/events/{event_id}/participants/export")
+async def api_export_participants(
     event_id: UUID,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user_id: UUID = Depends(get_current_user_id),
 ):
-    return list_participants(session, event_id, user_id)
+    lines = await export_participants(session, event_id, user_id)
+    return StreamingResponse(lines, media_type="application/x-ndjson")
 
 # ----- Organizer: approve -----
 @app.patch("/events/{event_id}/participants/{participant_id}/approve", response_model=OrganizerParticipantOut)
-def api_approve_participant(
+async def api_approve_participant(
     event_id: UUID,
     participant_id: UUID,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user_id: UUID = Depends(get_current_user_id),
 ):
-    with session.begin():
-        p = set_participant_status(session, event_id, user_id, participant_id, ParticipationStatus.APPROVED)
-    session.refresh(p)
+    async with session.begin():
+        p = await set_participant_status(session, event_id, user_id, participant_id, ParticipationStatus.APPROVED)
     return p
 
 # ----- Organizer: reject -----
 @app.patch("/events/{event_id}/participants/{participant_id}/reject", response_model=OrganizerParticipantOut)
-def api_reject_participant(
+async def api_reject_participant(
     event_id: UUID,
     participant_id: UUID,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_session),
     user_id: UUID = Depends(get_current_user_id),
 ):
-    with session.begin():
-        p = set_participant_status(session, event_id, user_id, participant_id, ParticipationStatus.REJECTED)
-    session.refresh(p)
+    async with session.begin():
+        p = await set_participant_status(session, event_id, user_id, participant_id, ParticipationStatus.REJECTED)
     return p
 
 # ----- Stats -----
 @app.get("/events/{event_id}/stats", response_model=EventStatsOut)
-def api_event_stats(event_id: UUID, session: Session = Depends(get_session)):
+async def api_event_stats(event_id: UUID, session: AsyncSession = Depends(get_session)):
     # readable without auth; if you want organizer-only, add Depends(get_current_user_id) + check
-    return event_stats(session, event_id)
+    return await event_stats(session, event_id)
@@ -1,11 +1,12 @@
 from __future__ import annotations
 from datetime import datetime, timezone
 from typing import Optional, List
-from uuid import UUID, uuid4
+from uuid import UUID
 
 from sqlmodel import SQLModel, Field, Index, Relationship
-from sqlalchemy import Column, Text, DateTime, Integer, CheckConstraint, UniqueConstraint, func
+from sqlalchemy import Column, Text, DateTime, Integer, Uuid, CheckConstraint, UniqueConstraint, func, text
 from sqlalchemy.dialects.postgresql import ENUM
+from sqlalchemy.orm import relationship
 
 from app.enums import (
     EventJoinPolicy, EventStatus,
@@ -13,9 +14,27 @@ from app.enums import (
     RideMatchStatus,
 )
 
+# one type object per PG enum, shared by every column that uses it; the types
+# themselves are created by the alembic migration (or init_db in dev), never per table
+EVENT_JOIN_POLICY_ENUM = ENUM(EventJoinPolicy, name="event_join_policy_enum", create_type=False)
+EVENT_STATUS_ENUM = ENUM(EventStatus, name="event_status_enum", create_type=False)
+PARTICIPATION_STATUS_ENUM = ENUM(ParticipationStatus, name="participation_status_enum", create_type=False)
+RIDE_MODE_ENUM = ENUM(RideMode, name="ride_mode_enum", create_type=False)
+RIDE_MATCH_STATUS_ENUM = ENUM(RideMatchStatus, name="ride_match_status_enum", create_type=False)
+
+PG_ENUMS = (
+    EVENT_JOIN_POLICY_ENUM, EVENT_STATUS_ENUM, PARTICIPATION_STATUS_ENUM,
+    RIDE_MODE_ENUM, RIDE_MATCH_STATUS_ENUM,
+)
+
 class User(SQLModel, table=True):
     __tablename__ = "users"
-    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    # server-generated columns (id, timestamps) come back via RETURNING on INSERT/UPDATE
+    __mapper_args__ = {"eager_defaults": True}
+    id: Optional[UUID] = Field(
+        default=None,
+        sa_column=Column(Uuid, primary_key=True, server_default=func.gen_random_uuid()),
+    )
     full_name: str = Field(sa_column=Column(Text, nullable=False))
     email: str = Field(sa_column=Column(Text, unique=True, nullable=False))
     phone: Optional[str] = Field(default=None, sa_column=Column(Text, nullable=True))
@@ -27,9 +46,13 @@ class User(SQLModel, table=True):
 
 class Event(SQLModel, table=True):
     __tablename__ = "events"
+    __mapper_args__ = {"eager_defaults": True}
     __table_args__ = (Index("idx_events_start_at", "start_at"),)
 
-    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    id: Optional[UUID] = Field(
+        default=None,
+        sa_column=Column(Uuid, primary_key=True, server_default=func.gen_random_uuid()),
+    )
     created_by_id: UUID = Field(foreign_key="users.id", index=True, nullable=False)
     #created_by: Optional[User] = Relationship(back_populates="events")
     #created_by: Optional["User"] = Relationship()
@@ -48,11 +71,11 @@ class Event(SQLModel, table=True):
     capacity: Optional[int] = Field(default=None, sa_column=Column(Integer, nullable=True))
 
     join_policy: EventJoinPolicy = Field(
-        sa_column=Column(ENUM(EventJoinPolicy, name="event_join_policy_enum"), nullable=False)
+        sa_column=Column(EVENT_JOIN_POLICY_ENUM, nullable=False)
     )
     status: EventStatus = Field(
         default=EventStatus.DRAFT,
-        sa_column=Column(ENUM(EventStatus, name="event_status_enum"), nullable=False, server_default=EventStatus.DRAFT.value),
+        sa_column=Column(EVENT_STATUS_ENUM, nullable=False, server_default=EventStatus.DRAFT.value),
     )
 
     created_at: datetime = Field(
@@ -66,32 +89,47 @@ class Event(SQLModel, table=True):
 
 class EventParticipant(SQLModel, table=True):
     __tablename__ = "event_participants"
+    __mapper_args__ = {"eager_defaults": True}
     __table_args__ = (
         UniqueConstraint("event_id", "user_id", name="uq_event_user"),
         CheckConstraint(
             "((ride_mode = 'OFFER' AND seats_offered >= 1) OR (ride_mode <> 'OFFER' AND seats_offered = 0))",
             name="chk_offer_seats",
         ),
-        Index("idx_participants_event_status", "event_id", "status"),
-        Index("idx_participants_event_ride", "event_id", "ride_mode"),
+        CheckConstraint("seats_taken >= 0", name="chk_seats_taken"),
+        # covering index: status/ride counts and seat sums are answered from the index alone
+        Index(
+            "idx_participants_event_status_cover", "event_id", "status",
+            postgresql_include=["ride_mode", "seats_offered"],
+        ),
+        # ride suggestions: approved drivers / riders of an event in join order
+        Index("idx_participants_event_ride_status", "event_id", "ride_mode", "status", "created_at"),
     )
 
-    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    id: Optional[UUID] = Field(
+        default=None,
+        sa_column=Column(Uuid, primary_key=True, server_default=func.gen_random_uuid()),
+    )
     event_id: UUID = Field(foreign_key="events.id", index=True)
     user_id: UUID = Field(index=True)
 
     status: ParticipationStatus = Field(
-        sa_column=Column(ENUM(ParticipationStatus, name="participation_status_enum"), nullable=False)
+        sa_column=Column(PARTICIPATION_STATUS_ENUM, nullable=False)
     )
 
     ride_mode: RideMode = Field(
         default=RideMode.NONE,
-        sa_column=Column(ENUM(RideMode, name="ride_mode_enum"), nullable=False, server_default=RideMode.NONE.value),
+        sa_column=Column(RIDE_MODE_ENUM, nullable=False, server_default=RideMode.NONE.value),
     )
     seats_offered: int = Field(
         default=0,
         sa_column=Column(Integer, nullable=False, server_default="0"),
     )
+    # ACCEPTED matches where this participant drives; kept in step with match transitions
+    seats_taken: int = Field(
+        default=0,
+        sa_column=Column(Integer, nullable=False, server_default="0"),
+    )
 
     pickup_area: Optional[str] = Field(default=None, sa_column=Column(Text, nullable=True))
     notes: Optional[str] = Field(default=None, sa_column=Column(Text, nullable=True))
@@ -105,22 +143,46 @@ class EventParticipant(SQLModel, table=True):
         sa_column=Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False),
     )
 
+# matches still holding (or asking for) a seat; literal SQL so ON CONFLICT can infer the partial index
+ACTIVE_MATCH_PREDICATE = "status IN ('PROPOSED', 'ACCEPTED')"
+
 class RideMatch(SQLModel, table=True):
     __tablename__ = "ride_matches"
+    __mapper_args__ = {"eager_defaults": True}
     __table_args__ = (
         CheckConstraint("driver_participant_id <> rider_participant_id", name="chk_driver_not_rider"),
         Index("idx_matches_event_status", "event_id", "status"),
+        # one live match per pair; rejected/canceled ones don't block a new proposal
+        Index(
+            "uq_matches_active_pair", "event_id", "driver_participant_id", "rider_participant_id",
+            unique=True, postgresql_where=text(ACTIVE_MATCH_PREDICATE),
+        ),
     )
 
-    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    id: Optional[UUID] = Field(
+        default=None,
+        sa_column=Column(Uuid, primary_key=True, server_default=func.gen_random_uuid()),
+    )
     event_id: UUID = Field(foreign_key="events.id", index=True)
 
     driver_participant_id: UUID = Field(foreign_key="event_participants.id", index=True)
     rider_participant_id: UUID = Field(foreign_key="event_participants.id", index=True)
+    # two FKs to the same table, so each side names its column; lazy="raise" makes a
+    # forgotten eager load fail loudly instead of issuing a query per match
+    driver: Optional[EventParticipant] = Relationship(
+        sa_relationship=relationship(
+            "EventParticipant", foreign_keys="RideMatch.driver_participant_id", lazy="raise", viewonly=True,
+        ),
+    )
+    rider: Optional[EventParticipant] = Relationship(
+        sa_relationship=relationship(
+            "EventParticipant", foreign_keys="RideMatch.rider_participant_id", lazy="raise", viewonly=True,
+        ),
+    )
 
     status: RideMatchStatus = Field(
         default=RideMatchStatus.PROPOSED,
-        sa_column=Column(ENUM(RideMatchStatus, name="ride_match_status_enum"), nullable=False, server_default=RideMatchStatus.PROPOSED.value),
+        sa_column=Column(RIDE_MATCH_STATUS_ENUM, nullable=False, server_default=RideMatchStatus.PROPOSED.value),
     )
 
     created_by: UUID = Field(index=True)
@@ -0,0 +1,19 @@
+import base64
+import binascii
+from datetime import datetime
+from uuid import UUID
+from fastapi import HTTPException
+
+# Opaque keyset cursor: base64("<sort timestamp iso>|<row id>") of the last row on a page.
+
+def encode_cursor(ts: datetime, row_id: UUID) -> str:
+    return base64.urlsafe_b64encode(f"{ts.isoformat()}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: str | None) -> tuple[datetime, UUID] | None:
+    if cursor is None:
+        return None
+    try:
+        ts, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(ts), UUID(row_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(400, "Invalid cursor")
\ No newline at end of file
@@ -1,6 +1,7 @@
 from datetime import datetime
 from typing import Optional
 from uuid import UUID
+from pydantic import TypeAdapter
 from sqlmodel import SQLModel, Field
 
 from .enums import EventJoinPolicy, RideMode, RideMatchStatus, ParticipationStatus, EventStatus
@@ -26,6 +27,13 @@ class EventRead(SQLModel):
     join_policy: EventJoinPolicy
     status: EventStatus
 
+class EventListOut(SQLModel):
+    id: UUID
+    title: str
+    start_at: datetime
+    location_name: str
+    status: EventStatus
+
 class EventCreate(SQLModel):
     title: str
     description: Optional[str] = None
@@ -83,4 +91,7 @@ class EventStatsOut(SQLModel):
     seats_accepted_total: int
     seats_remaining_total: int
 
-    unmatched_riders_count: int
\ No newline at end of file
+    unmatched_riders_count: int
+# built once at import; list responses are validated/serialized in a single call
+EventListAdapter = TypeAdapter(list[EventListOut])
+OrganizerParticipantListAdapter = TypeAdapter(list[OrganizerParticipantOut])
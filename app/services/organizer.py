@@ -1,156 +1,192 @@
+from datetime import datetime
 from uuid import UUID
+import orjson
 from fastapi import HTTPException
-from sqlmodel import Session
-from sqlalchemy import select, func, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import select, func, update, case, and_, or_, exists, tuple_
+from sqlalchemy.orm import aliased
 
+from app.cache import get_stats, put_stats, invalidate_stats_on_commit, recently_invalidated
 from app.models import Event, EventParticipant, RideMatch
+from app.views import event_stats_mv, STATS_MV_REFRESH_SECONDS
+from app.services.participants import lock_event_capacity
 from app.enums import (
     ParticipationStatus, RideMode, RideMatchStatus,
     EventJoinPolicy
 )
 
-def _ensure_organizer(session: Session, event_id: UUID, user_id: UUID) -> Event:
-    event = session.exec(select(Event).where(Event.id == event_id)).one_or_none()
+async def _ensure_organizer(session: AsyncSession, event_id: UUID, user_id: UUID) -> Event:
+    event = await session.get(Event, event_id)
     if not event:
         raise HTTPException(404, "Event not found")
     if event.created_by_id != user_id:
         raise HTTPException(403, "Forbidden")
     return event
 
-def list_participants(session: Session, event_id: UUID, organizer_id: UUID):
-    _ensure_organizer(session, event_id, organizer_id)
-    return session.exec(
-        select(EventParticipant)
+def _participants_out_stmt(event_id: UUID):
+    # only the OrganizerParticipantOut columns (+ created_at for the keyset cursor)
+    return (
+        select(
+            EventParticipant.id,
+            EventParticipant.event_id,
+            EventParticipant.user_id,
+            EventParticipant.status,
+            EventParticipant.ride_mode,
+            EventParticipant.seats_offered,
+            EventParticipant.pickup_area,
+            EventParticipant.notes,
+            EventParticipant.created_at,
+        )
         .where(EventParticipant.event_id == event_id)
-        .order_by(EventParticipant.created_at.asc())
-    ).all()
+        .order_by(EventParticipant.created_at.asc(), EventParticipant.id.asc())
+    )
 
-def set_participant_status(session: Session, event_id: UUID, organizer_id: UUID, participant_id: UUID, next_status: ParticipationStatus):
-    if next_status not in (ParticipationStatus.APPROVED, ParticipationStatus.REJECTED):
-        raise HTTPException(400, "Invalid status change")
+async def list_participants(session: AsyncSession, event_id: UUID, organizer_id: UUID, limit: int = 100, after: tuple[datetime, UUID] | None = None):
+    await _ensure_organizer(session, event_id, organizer_id)
+    stmt = _participants_out_stmt(event_id).limit(limit)
+    if after:
+        stmt = stmt.where(tuple_(EventParticipant.created_at, EventParticipant.id) > after)
+    # returned as mappings, no ORM instances
+    return (await session.exec(stmt)).mappings().all()
 
-    # lock event + participant to enforce capacity safely
-    event = session.exec(
-        select(Event).where(Event.id == event_id).with_for_update()
-    ).one_or_none()
-    if not event:
-        raise HTTPException(404, "Event not found")
-    if event.created_by_id != organizer_id:
-        raise HTTPException(403, "Forbidden")
+async def export_participants(session: AsyncSession, event_id: UUID, organizer_id: UUID):
+    await _ensure_organizer(session, event_id, organizer_id)
+    # server-side cursor: rows are fetched and written out in chunks, never all held in memory
+    result = await session.stream(_participants_out_stmt(event_id).execution_options(yield_per=500))
 
-    p = session.exec(
-        select(EventParticipant)
-        .where(EventParticipant.id == participant_id, EventParticipant.event_id == event_id)
-        .with_for_update()
-    ).one_or_none()
-    if not p:
-        raise HTTPException(404, "Participant not found")
-    if p.status == ParticipationStatus.CANCELED:
-        raise HTTPException(400, "Cannot change status of canceled participant")
-    if next_status == ParticipationStatus.APPROVED:
-        if event.capacity is not None:
-            approved = session.exec(
-                select(func.count())
-                .select_from(EventParticipant)
-                .where(
-                    EventParticipant.event_id == event_id,
-                    EventParticipant.status == ParticipationStatus.APPROVED,
-                )
-            ).one()
-            approved_count = int(approved)
-            if approved_count >= event.capacity:
-                raise HTTPException(400, "Cannot approve: event is full")
-
-    p.status = next_status
-    session.add(p)
-    session.flush()
-    return p
-
-def event_stats(session: Session, event_id: UUID):
-    # participation status counts
-    def _count_status(status: ParticipationStatus) -> int:
-        return int(session.exec(
-            select(func.count())
-            .select_from(EventParticipant)
-            .where(EventParticipant.event_id == event_id, EventParticipant.status == status)
-        ).one())
+    async def lines():
+        async for row in result.mappings():
+            yield orjson.dumps(dict(row)) + b"\n"
 
-    approved_count = _count_status(ParticipationStatus.APPROVED)
-    pending_count = _count_status(ParticipationStatus.PENDING)
-    rejected_count = _count_status(ParticipationStatus.REJECTED)
-    canceled_count = _count_status(ParticipationStatus.CANCELED)
+    return lines()
 
-    need_ride_count = int(session.exec(
-        select(func.count())
-        .select_from(EventParticipant)
-        .where(
-            EventParticipant.event_id == event_id,
-            EventParticipant.status == ParticipationStatus.APPROVED,
-            EventParticipant.ride_mode == RideMode.NEED
-        )
-    ).one())
+async def set_participant_status(session: AsyncSession, event_id: UUID, organizer_id: UUID, participant_id: UUID, next_status: ParticipationStatus):
+    if next_status not in (ParticipationStatus.APPROVED, ParticipationStatus.REJECTED):
+        raise HTTPException(400, "Invalid status change")
 
-    offer_ride_count = int(session.exec(
-        select(func.count())
-        .select_from(EventParticipant)
-        .where(
-            EventParticipant.event_id == event_id,
-            EventParticipant.status == ParticipationStatus.APPROVED,
-            EventParticipant.ride_mode == RideMode.OFFER
+    # organizer check, canceled guard and capacity check folded into one conditional UPDATE
+    conditions = [
+        EventParticipant.id == participant_id,
+        EventParticipant.event_id == event_id,
+        EventParticipant.status != ParticipationStatus.CANCELED,
+        Event.id == event_id,
+        Event.created_by_id == organizer_id,
+    ]
+    if next_status == ParticipationStatus.APPROVED:
+        await lock_event_capacity(session, event_id)
+        approved = aliased(EventParticipant)
+        approved_count = (
+            select(func.count())
+            .select_from(approved)
+            .where(approved.event_id == event_id, approved.status == ParticipationStatus.APPROVED)
+            .scalar_subquery()
         )
-    ).one())
-
-    seats_offered_total = int(session.exec(
-        select(func.coalesce(func.sum(EventParticipant.seats_offered), 0))
-        .where(
-            EventParticipant.event_id == event_id,
-            EventParticipant.status == ParticipationStatus.APPROVED,
-            EventParticipant.ride_mode == RideMode.OFFER
+        conditions.append(or_(Event.capacity.is_(None), approved_count < Event.capacity))
+
+    stmt = (
+        update(EventParticipant)
+        .where(*conditions)
+        .values(status=next_status)
+        .returning(EventParticipant)
+    )
+    p = await session.scalar(
+        select(EventParticipant).from_statement(stmt).execution_options(populate_existing=True)
+    )
+    if p:
+        invalidate_stats_on_commit(session, event_id)
+        return p
+
+    # nothing updated: work out which check failed
+    await _ensure_organizer(session, event_id, organizer_id)
+    p = await session.get(EventParticipant, participant_id)
+    if not p or p.event_id != event_id:
+        raise HTTPException(404, "Participant not found")
+    if p.status == ParticipationStatus.CANCELED:
+        raise HTTPException(400, "Cannot change status of canceled participant")
+    raise HTTPException(400, "Cannot approve: event is full")
+
+async def event_stats(session: AsyncSession, event_id: UUID):
+    cached = get_stats(event_id)
+    if cached is not None:
+        return cached
+
+    # a write is in the view once a refresh that started after it has finished: at most
+    # two intervals. Until then this worker reads its own writes live.
+    if not recently_invalidated(event_id, 2 * STATS_MV_REFRESH_SECONDS):
+        row = (await session.exec(
+            select(event_stats_mv).where(event_stats_mv.c.event_id == event_id)
+        )).mappings().one_or_none()
+        if row is not None:
+            # the view is already the cache: not copied into the TTL cache, which would
+            # only add STATS_CACHE_TTL on top of the view's own staleness
+            stats = dict(row)
+            stats["seats_remaining_total"] = max(0, row["seats_offered_total"] - row["seats_accepted_total"])
+            return stats
+
+    # recently written, or created since the last view refresh
+    stats = await _live_event_stats(session, event_id)
+    put_stats(event_id, stats)
+    return stats
+
+async def _live_event_stats(session: AsyncSession, event_id: UUID):
+    approved = EventParticipant.status == ParticipationStatus.APPROVED
+
+    # participation status + ride counts in a single pass
+    counts = (await session.exec(
+        select(
+            func.count().filter(approved).label("approved_count"),
+            func.count().filter(EventParticipant.status == ParticipationStatus.PENDING).label("pending_count"),
+            func.count().filter(EventParticipant.status == ParticipationStatus.REJECTED).label("rejected_count"),
+            func.count().filter(EventParticipant.status == ParticipationStatus.CANCELED).label("canceled_count"),
+            func.count().filter(approved, EventParticipant.ride_mode == RideMode.NEED).label("need_ride_count"),
+            func.count().filter(approved, EventParticipant.ride_mode == RideMode.OFFER).label("offer_ride_count"),
+            func.coalesce(
+                func.sum(case(
+                    (and_(approved, EventParticipant.ride_mode == RideMode.OFFER), EventParticipant.seats_offered),
+                    else_=0,
+                )),
+                0,
+            ).label("seats_offered_total"),
         )
-    ).one())
+        .where(EventParticipant.event_id == event_id)
+    )).one()
 
-    seats_accepted_total = int(session.exec(
+    seats_accepted_total = await session.scalar(
         select(func.count())
         .select_from(RideMatch)
         .where(
             RideMatch.event_id == event_id,
             RideMatch.status == RideMatchStatus.ACCEPTED
         )
-    ).one())
+    )
 
+    seats_offered_total = int(counts.seats_offered_total)
     seats_remaining_total = max(0, seats_offered_total - seats_accepted_total)
 
     # Riders who still need ride AND have no accepted match
-    # unmatched = NEED riders minus distinct riders in accepted matches
-    need_riders_ids = session.exec(
-        select(EventParticipant.id)
+    unmatched_riders_count = await session.scalar(
+        select(func.count())
+        .select_from(EventParticipant)
         .where(
             EventParticipant.event_id == event_id,
-            EventParticipant.status == ParticipationStatus.APPROVED,
-            EventParticipant.ride_mode == RideMode.NEED
+            approved,
+            EventParticipant.ride_mode == RideMode.NEED,
+            ~exists().where(
+                RideMatch.event_id == event_id,
+                RideMatch.status == RideMatchStatus.ACCEPTED,
+                RideMatch.rider_participant_id == EventParticipant.id,
+            ),
         )
-    ).all()
-    need_riders_set = set(need_riders_ids)
-
-    accepted_riders_ids = session.exec(
-        select(RideMatch.rider_participant_id)
-        .where(
-            RideMatch.event_id == event_id,
-            RideMatch.status == RideMatchStatus.ACCEPTED
-        )
-    ).all()
-    accepted_riders_set = set(accepted_riders_ids)
-
-    unmatched_riders_count = len(need_riders_set - accepted_riders_set)
+    )
 
     return {
         "event_id": event_id,
-        "approved_count": approved_count,
-        "pending_count": pending_count,
-        "rejected_count": rejected_count,
-        "canceled_count": canceled_count,
-        "need_ride_count": need_ride_count,
-        "offer_ride_count": offer_ride_count,
+        "approved_count": counts.approved_count,
+        "pending_count": counts.pending_count,
+        "rejected_count": counts.rejected_count,
+        "canceled_count": counts.canceled_count,
+        "need_ride_count": counts.need_ride_count,
+        "offer_ride_count": counts.offer_ride_count,
         "seats_offered_total": seats_offered_total,
         "seats_accepted_total": seats_accepted_total,
         "seats_remaining_total": seats_remaining_total,
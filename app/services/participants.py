@@ -1,8 +1,11 @@
 from uuid import UUID
 from fastapi import HTTPException
-from sqlmodel import Session
-from sqlalchemy import select, func, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import select, func, update, lambda_stmt, case, and_, cast, literal, null
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
 
+from app.cache import invalidate_stats_on_commit
 from app.models import Event, EventParticipant, RideMatch
 from app.enums import (
     EventJoinPolicy, EventStatus,
@@ -20,13 +23,6 @@ def _normalize_ride(ride_mode: RideMode, seats_offered: int | None):
         raise HTTPException(400, "seats_offered must be 0 unless ride_mode=OFFER")
     return ride_mode, 0
 
-def _count_approved(session: Session, event_id: UUID) -> int:
-    stmt = select(func.count()).select_from(EventParticipant).where(
-        EventParticipant.event_id == event_id,
-        EventParticipant.status == ParticipationStatus.APPROVED,
-    )
-    return int(session.exec(stmt).one())
-
 def _resolve_join_status(event: Event, approved_count: int) -> ParticipationStatus:
     if event.status != EventStatus.PUBLISHED:
         raise HTTPException(400, "Event is not published")
@@ -48,97 +44,195 @@ def _resolve_join_status(event: Event, approved_count: int) -> ParticipationStat
 
     return ParticipationStatus.PENDING
 
-def join_event(session: Session, event_id: UUID, user_id: UUID, ride_mode: RideMode, seats_offered: int | None, pickup_area: str | None, notes: str | None) -> EventParticipant:
-    # lock event
-    event = session.exec(
-        select(Event).where(Event.id == event_id).with_for_update()
-    ).one_or_none()
-    if not event:
-        raise HTTPException(404, "Event not found")
-    if event.status == EventStatus.CANCELED:
-        raise HTTPException(400, "Event is canceled")
+async def lock_event_capacity(session: AsyncSession, event_id: UUID):
+    # serializes everything that can approve a participant of this event (join, organizer
+    # approve, auto-promote) until commit, so the approved count read by the next statement
+    # is current and capacity stays a hard limit; readers and other events are unaffected.
+    # Must be its own statement: a lock taken inside a statement doesn't refresh its snapshot.
+    # Lock order: every caller takes this before any event_participants row lock in the same
+    # transaction (join's upsert, leave's cancel, approve's UPDATE), or two paths deadlock.
+    await session.exec(select(func.pg_advisory_xact_lock(func.hashtext(str(event_id)))))
 
-    approved = _count_approved(session, event_id)
-    status = _resolve_join_status(event, approved)
+def _join_status_sql(approved_count):
+    # SQL mirror of _resolve_join_status; NULL where the join must be refused
+    approved = cast(literal(ParticipationStatus.APPROVED), EventParticipant.status.type)
+    pending = cast(literal(ParticipationStatus.PENDING), EventParticipant.status.type)
+    is_full = and_(Event.capacity.is_not(None), approved_count >= Event.capacity)
+    return case(
+        (is_full, case((Event.join_policy == EventJoinPolicy.OPEN, null()), else_=pending)),
+        (Event.join_policy.in_([EventJoinPolicy.OPEN, EventJoinPolicy.OPEN_UNTIL_CAPACITY_THEN_APPROVAL]), approved),
+        else_=pending,
+    )
 
+async def join_event(session: AsyncSession, event_id: UUID, user_id: UUID, ride_mode: RideMode, seats_offered: int | None, pickup_area: str | None, notes: str | None) -> EventParticipant:
     ride_mode, seats_offered = _normalize_ride(ride_mode, seats_offered)
 
-    p = session.exec(
-        select(EventParticipant)
-        .where(EventParticipant.event_id == event_id, EventParticipant.user_id == user_id)
-        .with_for_update()
-    ).one_or_none()
+    # before the upsert, which may lock an existing (e.g. canceled) row of this user
+    await lock_event_capacity(session, event_id)
 
-    if not p:
-        p = EventParticipant(
-            event_id=event_id,
-            user_id=user_id,
-            status=status,
-            ride_mode=ride_mode,
-            seats_offered=seats_offered,
-            pickup_area=pickup_area,
-            notes=notes,
-        )
-        session.add(p)
-    else:
-        p.status = status
-        p.ride_mode = ride_mode
-        p.seats_offered = seats_offered
-        if pickup_area is not None:
-            p.pickup_area = pickup_area
-        if notes is not None:
-            p.notes = notes
-
-    session.flush()
-    return p
+    # status resolved inline from the event row + approved count, upserted in one statement
+    approved_count = (
+        select(func.count())
+        .select_from(EventParticipant)
+        .where(EventParticipant.event_id == event_id, EventParticipant.status == ParticipationStatus.APPROVED)
+        .scalar_subquery()
+    )
+    resolved = (
+        select(Event.id.label("event_id"), _join_status_sql(approved_count).label("status"))
+        .where(Event.id == event_id, Event.status == EventStatus.PUBLISHED)
+        .cte("resolved")
+    )
+    ins = pg_insert(EventParticipant).from_select(
+        ["event_id", "user_id", "status", "ride_mode", "seats_offered", "pickup_area", "notes"],
+        select(
+            resolved.c.event_id,
+            literal(user_id, EventParticipant.user_id.type),
+            resolved.c.status,
+            cast(literal(ride_mode), EventParticipant.ride_mode.type),
+            literal(seats_offered),
+            literal(pickup_area, EventParticipant.pickup_area.type),
+            literal(notes, EventParticipant.notes.type),
+        ).where(resolved.c.status.is_not(None)),
+    )
+    stmt = ins.on_conflict_do_update(
+        index_elements=[EventParticipant.event_id, EventParticipant.user_id],
+        set_={
+            "status": ins.excluded.status,
+            "ride_mode": ins.excluded.ride_mode,
+            "seats_offered": ins.excluded.seats_offered,
+            "pickup_area": func.coalesce(ins.excluded.pickup_area, EventParticipant.pickup_area),
+            "notes": func.coalesce(ins.excluded.notes, EventParticipant.notes),
+            "updated_at": func.now(),
+        },
+    ).returning(EventParticipant)
 
-def leave_event(session: Session, event_id: UUID, user_id: UUID) -> EventParticipant:
-    p = session.exec(
-        select(EventParticipant)
-        .where(EventParticipant.event_id == event_id, EventParticipant.user_id == user_id)
-        .with_for_update()
-    ).one_or_none()
-    if not p:
-        raise HTTPException(404, "Not joined")
+    p = await session.scalar(
+        select(EventParticipant).from_statement(stmt).execution_options(populate_existing=True)
+    )
+    if p:
+        invalidate_stats_on_commit(session, event_id)
+        return p
 
-    p.status = ParticipationStatus.CANCELED
-    p.ride_mode = RideMode.NONE
-    p.seats_offered = 0
+    # nothing inserted: re-read the event and its approved count in one trip to report why
+    row = (await session.exec(select(Event, approved_count).where(Event.id == event_id))).first()
+    if not row:
+        raise HTTPException(404, "Event not found")
+    event, approved = row
+    if event.status == EventStatus.CANCELED:
+        raise HTTPException(400, "Event is canceled")
+    _resolve_join_status(event, approved)
+    raise HTTPException(409, "Event changed while joining, try again")
 
-    # cancel active matches
-    session.exec(
-        update(RideMatch)
+def _cancel_live_matches(event_id: UUID, pid):
+    # pid's PROPOSED/ACCEPTED matches, read FOR UPDATE: the lock waits out a concurrent
+    # accept/reject and re-reads the row, so the seats handed back and the matches
+    # canceled are both computed from the same, current rows (not the statement snapshot)
+    live = (
+        select(RideMatch.id, RideMatch.driver_participant_id, RideMatch.rider_participant_id, RideMatch.status)
         .where(
             RideMatch.event_id == event_id,
             RideMatch.status.in_([RideMatchStatus.PROPOSED, RideMatchStatus.ACCEPTED]),
-            (RideMatch.driver_participant_id == p.id) | (RideMatch.rider_participant_id == p.id),
+            (RideMatch.driver_participant_id == pid) | (RideMatch.rider_participant_id == pid),
         )
+        .with_for_update()
+        .cte("live_matches")
+    )
+    # drivers pid rides with get back the seats of its ACCEPTED matches
+    held = (
+        select(live.c.driver_participant_id, func.count().label("accepted"))
+        .where(live.c.rider_participant_id == pid, live.c.status == RideMatchStatus.ACCEPTED)
+        .group_by(live.c.driver_participant_id)
+        .subquery()
+    )
+    release_seats = (
+        update(EventParticipant)
+        .where(EventParticipant.id == held.c.driver_participant_id)
+        .values(seats_taken=EventParticipant.seats_taken - held.c.accepted)
+        .cte("release_seats")
+    )
+    cancel = (
+        update(RideMatch)
+        .where(RideMatch.id.in_(select(live.c.id)))
         .values(status=RideMatchStatus.CANCELED)
     )
+    return release_seats, cancel
 
-    # optional auto-promote pending for OPEN_UNTIL_CAPACITY_THEN_APPROVAL
-    event = session.exec(select(Event).where(Event.id == event_id).with_for_update()).one()
-    if event.join_policy == EventJoinPolicy.OPEN_UNTIL_CAPACITY_THEN_APPROVAL and event.capacity:
-        approved = _count_approved(session, event_id)
-        if approved < event.capacity:
-            oldest_pending = session.exec(
-                select(EventParticipant)
-                .where(EventParticipant.event_id == event_id, EventParticipant.status == ParticipationStatus.PENDING)
-                .order_by(EventParticipant.created_at.asc())
-                .with_for_update()
-            ).one_or_none()
-            if oldest_pending:
-                oldest_pending.status = ParticipationStatus.APPROVED
-
-    session.flush()
+def _promote_oldest_pending(event_id: UUID, capacity: int):
+    # approve the oldest pending participant if there is room, as one atomic statement;
+    # run under lock_event_capacity. SKIP LOCKED passes over a pending row that its owner
+    # is updating right now (e.g. update_my_participation) instead of waiting on it
+    approved, pending = aliased(EventParticipant), aliased(EventParticipant)
+    approved_count = (
+        select(func.count())
+        .select_from(approved)
+        .where(approved.event_id == event_id, approved.status == ParticipationStatus.APPROVED)
+        .scalar_subquery()
+    )
+    oldest_pending = (
+        select(pending.id)
+        .where(pending.event_id == event_id, pending.status == ParticipationStatus.PENDING, approved_count < capacity)
+        .order_by(pending.created_at.asc())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return (
+        update(EventParticipant)
+        .where(EventParticipant.id == oldest_pending)
+        .values(status=ParticipationStatus.APPROVED)
+        .returning(EventParticipant.id)
+    )
+
+async def leave_event(session: AsyncSession, event_id: UUID, user_id: UUID) -> EventParticipant:
+    # optional auto-promote pending for OPEN_UNTIL_CAPACITY_THEN_APPROVAL;
+    # join_policy/capacity are only read here, no row lock needed
+    event = await session.get(Event, event_id)
+    promote = (
+        event is not None
+        and event.join_policy == EventJoinPolicy.OPEN_UNTIL_CAPACITY_THEN_APPROVAL
+        and event.capacity
+    )
+    if promote:
+        # advisory lock before any participant row lock (see lock_event_capacity)
+        await lock_event_capacity(session, event_id)
+
+    me = aliased(EventParticipant)
+    my_id = (
+        select(me.id)
+        .where(me.event_id == event_id, me.user_id == user_id)
+        .scalar_subquery()
+    )
+    # free seats on drivers I ride with + cancel active matches (data-modifying CTEs)
+    # + cancel participation in one round trip
+    release_seats, cancel = _cancel_live_matches(event_id, my_id)
+    cancel_matches = cancel.cte("cancel_matches")
+    stmt = (
+        update(EventParticipant)
+        .where(EventParticipant.event_id == event_id, EventParticipant.user_id == user_id)
+        .values(status=ParticipationStatus.CANCELED, ride_mode=RideMode.NONE, seats_offered=0, seats_taken=0)
+        .add_cte(release_seats)
+        .add_cte(cancel_matches)
+        .returning(EventParticipant)
+    )
+    p = await session.scalar(
+        select(EventParticipant).from_statement(stmt).execution_options(populate_existing=True)
+    )
+    if not p:
+        raise HTTPException(404, "Not joined")
+
+    if promote:
+        await session.exec(_promote_oldest_pending(event_id, event.capacity))
+
+    await session.flush()
+    invalidate_stats_on_commit(session, event_id)
     return p
 
-def update_my_participation(session: Session, event_id: UUID, user_id: UUID, ride_mode: RideMode | None, seats_offered: int | None, pickup_area: str | None, notes: str | None) -> EventParticipant:
-    p = session.exec(
-        select(EventParticipant)
+async def update_my_participation(session: AsyncSession, event_id: UUID, user_id: UUID, ride_mode: RideMode | None, seats_offered: int | None, pickup_area: str | None, notes: str | None) -> EventParticipant:
+    p = await session.scalar(lambda_stmt(
+        lambda: select(EventParticipant)
         .where(EventParticipant.event_id == event_id, EventParticipant.user_id == user_id)
         .with_for_update()
-    ).one_or_none()
+    ))
     if not p:
         raise HTTPException(404, "Not joined")
 
@@ -159,15 +253,12 @@ def update_my_participation(session: Session, event_id: UUID, user_id: UUID, rid
         p.notes = notes
 
     if prev_mode != p.ride_mode:
-        session.exec(
-            update(RideMatch)
-            .where(
-                RideMatch.event_id == event_id,
-                RideMatch.status.in_([RideMatchStatus.PROPOSED, RideMatchStatus.ACCEPTED]),
-                (RideMatch.driver_participant_id == p.id) | (RideMatch.rider_participant_id == p.id),
-            )
-            .values(status=RideMatchStatus.CANCELED)
-        )
+        # all of p's matches are canceled below: as a driver nothing stays taken,
+        # as a rider the drivers get their seats back
+        p.seats_taken = 0
+        release_seats, cancel = _cancel_live_matches(event_id, p.id)
+        await session.exec(cancel.add_cte(release_seats))
 
-    session.flush()
+    await session.flush()
+    invalidate_stats_on_commit(session, event_id)
     return p
@@ -1,27 +1,34 @@
+from datetime import datetime
 from uuid import UUID
+import orjson
 from fastapi import HTTPException
-from sqlmodel import Session
-from sqlalchemy import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import select, func, update, tuple_, true, text, or_, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import joinedload, aliased
 
-from app.models import EventParticipant, RideMatch
+from app.cache import invalidate_stats_on_commit
+from app.models import EventParticipant, RideMatch, ACTIVE_MATCH_PREDICATE
 from app.enums import ParticipationStatus, RideMode, RideMatchStatus
 
-def _accepted_count(session: Session, event_id: UUID, driver_pid: UUID) -> int:
-    stmt = select(func.count()).select_from(RideMatch).where(
-        RideMatch.event_id == event_id,
-        RideMatch.driver_participant_id == driver_pid,
-        RideMatch.status == RideMatchStatus.ACCEPTED,
-    )
-    return int(session.exec(stmt).one())
-
-def _ensure_compatible_and_seat(session: Session, event_id: UUID, driver_pid: UUID, rider_pid: UUID):
-    driver = session.exec(
-        select(EventParticipant).where(EventParticipant.id == driver_pid, EventParticipant.event_id == event_id).with_for_update()
-    ).one_or_none()
-    rider = session.exec(
-        select(EventParticipant).where(EventParticipant.id == rider_pid, EventParticipant.event_id == event_id).with_for_update()
-    ).one_or_none()
+async def _lock_participants(session: AsyncSession, event_id: UUID, pids, claim_seat: bool = False) -> dict:
+    # all rows locked in one round trip; ordered by id so concurrent matches lock in the same order.
+    # A proposal only needs the participants not to change underneath it (FOR SHARE, so proposals
+    # for the same driver don't queue). Claiming a seat writes the driver row next, so take
+    # FOR NO KEY UPDATE up front rather than upgrading a share lock (deadlock-prone).
+    lock = {"key_share": True} if claim_seat else {"read": True}
+    rows = (await session.scalars(
+        select(EventParticipant)
+        .where(EventParticipant.event_id == event_id, EventParticipant.id.in_(pids))
+        .order_by(EventParticipant.id)
+        .with_for_update(**lock)
+        # rows may already be in the identity map (e.g. joinedloaded by update_match_status);
+        # overwrite them with the values read under the lock
+        .execution_options(populate_existing=True)
+    )).all()
+    return {r.id: r for r in rows}
 
+def _check_pair(driver: EventParticipant | None, rider: EventParticipant | None):
     if not driver or not rider:
         raise HTTPException(404, "Driver or rider not found")
     if driver.id == rider.id:
@@ -33,84 +40,225 @@ def _ensure_compatible_and_seat(session: Session, event_id: UUID, driver_pid: UU
     if rider.ride_mode != RideMode.NEED:
         raise HTTPException(400, "Rider does not need a ride")
 
-    accepted = _accepted_count(session, event_id, driver.id)
-    if accepted >= driver.seats_offered:
+    if driver.seats_taken >= driver.seats_offered:
         raise HTTPException(400, "No seats remaining for this driver")
 
-def create_match(session: Session, event_id: UUID, created_by: UUID, driver_pid: UUID, rider_pid: UUID) -> RideMatch:
-    _ensure_compatible_and_seat(session, event_id, driver_pid, rider_pid)
-    m = RideMatch(
-        event_id=event_id,
-        driver_participant_id=driver_pid,
-        rider_participant_id=rider_pid,
-        status=RideMatchStatus.PROPOSED,
-        created_by=created_by,
+async def _ensure_compatible_and_seat(session: AsyncSession, event_id: UUID, driver_pid: UUID, rider_pid: UUID, claim_seat: bool = False):
+    by_id = await _lock_participants(session, event_id, [driver_pid, rider_pid], claim_seat)
+    _check_pair(by_id.get(driver_pid), by_id.get(rider_pid))
+
+async def _take_seat(session: AsyncSession, driver_pid: UUID):
+    # conditional increment: the seat check and the claim are one atomic statement
+    taken = await session.scalar(
+        update(EventParticipant)
+        .where(EventParticipant.id == driver_pid, EventParticipant.seats_taken < EventParticipant.seats_offered)
+        .values(seats_taken=EventParticipant.seats_taken + 1)
+        .returning(EventParticipant.id)
+    )
+    if taken is None:
+        raise HTTPException(400, "No seats remaining for this driver")
+
+def _insert_proposals(event_id: UUID, created_by: UUID, pairs):
+    # pairs that already have a live match are skipped by uq_matches_active_pair
+    stmt = pg_insert(RideMatch).values([
+        {
+            "event_id": event_id,
+            "driver_participant_id": driver_pid,
+            "rider_participant_id": rider_pid,
+            "status": RideMatchStatus.PROPOSED,
+            "created_by": created_by,
+        }
+        for driver_pid, rider_pid in pairs
+    ]).on_conflict_do_nothing(
+        index_elements=[RideMatch.event_id, RideMatch.driver_participant_id, RideMatch.rider_participant_id],
+        index_where=text(ACTIVE_MATCH_PREDICATE),
+    ).returning(RideMatch)
+    return select(RideMatch).from_statement(stmt).execution_options(populate_existing=True)
+
+def _active_matches(event_id: UUID, pairs):
+    return select(RideMatch).where(
+        RideMatch.event_id == event_id,
+        tuple_(RideMatch.driver_participant_id, RideMatch.rider_participant_id).in_(pairs),
+        text(ACTIVE_MATCH_PREDICATE),
     )
-    session.add(m)
-    session.flush()
+
+async def create_match(session: AsyncSession, event_id: UUID, created_by: UUID, driver_pid: UUID, rider_pid: UUID) -> RideMatch:
+    await _ensure_compatible_and_seat(session, event_id, driver_pid, rider_pid)
+    m = await session.scalar(_insert_proposals(event_id, created_by, [(driver_pid, rider_pid)]))
+    if m is None:
+        # pair already proposed/accepted (e.g. a double submit): hand back that match
+        return await session.scalar(_active_matches(event_id, [(driver_pid, rider_pid)]))
+    invalidate_stats_on_commit(session, event_id)
     return m
 
-def update_match_status(session: Session, match_id: UUID, user_id: UUID, next_status: RideMatchStatus) -> RideMatch:
+async def create_matches(session: AsyncSession, event_id: UUID, created_by: UUID, pairs: list[tuple[UUID, UUID]]) -> list[RideMatch]:
+    # bulk version of create_match: one participant fetch, one INSERT, all-or-nothing
+    if not pairs:
+        return []
+    by_id = await _lock_participants(session, event_id, list({pid for pair in pairs for pid in pair}))
+    for driver_pid, rider_pid in pairs:
+        _check_pair(by_id.get(driver_pid), by_id.get(rider_pid))
+    matches = (await session.scalars(_insert_proposals(event_id, created_by, pairs))).all()
+    invalidate_stats_on_commit(session, event_id)
+    if len(matches) < len(set(pairs)):
+        # some pairs already had a live match: return those alongside the new ones
+        matches = (await session.scalars(_active_matches(event_id, pairs))).all()
+    return matches
+
+def _close_match_stmt(match_id: UUID, user_id: UUID, next_status: RideMatchStatus):
+    # REJECTED/CANCELED as one statement:
+    #   prev     locks the match and reads its status as of the lock (not the statement snapshot)
+    #   changed  applies the transition if user_id is the creator, driver or rider
+    #   released hands the seat back when the match had been ACCEPTED
+    prev = (
+        select(RideMatch.id, RideMatch.status.label("prev_status"))
+        .where(RideMatch.id == match_id)
+        .with_for_update()
+        .cte("prev")
+    )
+    party = aliased(EventParticipant)
+    is_party = or_(
+        RideMatch.created_by == user_id,
+        exists().where(
+            party.id.in_([RideMatch.driver_participant_id, RideMatch.rider_participant_id]),
+            party.user_id == user_id,
+        ),
+    )
+    changed = (
+        update(RideMatch)
+        .where(RideMatch.id == prev.c.id, is_party)
+        .values(status=next_status)
+        .returning(*RideMatch.__table__.c, prev.c.prev_status)
+        .cte("changed")
+    )
+    released = (
+        update(EventParticipant)
+        .where(
+            EventParticipant.id == changed.c.driver_participant_id,
+            changed.c.prev_status == RideMatchStatus.ACCEPTED,
+            EventParticipant.seats_taken > 0,
+        )
+        .values(seats_taken=EventParticipant.seats_taken - 1)
+        .cte("released")
+    )
+    stmt = select(*(changed.c[c.name] for c in RideMatch.__table__.c)).add_cte(released)
+    return select(RideMatch).from_statement(stmt).execution_options(populate_existing=True)
+
+async def update_match_status(session: AsyncSession, match_id: UUID, user_id: UUID, next_status: RideMatchStatus) -> RideMatch:
     if next_status not in (RideMatchStatus.ACCEPTED, RideMatchStatus.REJECTED, RideMatchStatus.CANCELED):
         raise HTTPException(400, "Invalid next status")
 
-    m = session.exec(select(RideMatch).where(RideMatch.id == match_id).with_for_update()).one_or_none()
+    if next_status != RideMatchStatus.ACCEPTED:
+        m = await session.scalar(_close_match_stmt(match_id, user_id, next_status))
+        if not m:
+            # nothing updated: missing match or not a party to it
+            if not await session.get(RideMatch, match_id):
+                raise HTTPException(404, "Match not found")
+            raise HTTPException(403, "Forbidden")
+        invalidate_stats_on_commit(session, m.event_id)
+        return m
+
+    # match + both participants in one round trip; only the match row is locked
+    m = await session.get(
+        RideMatch, match_id,
+        options=[joinedload(RideMatch.driver), joinedload(RideMatch.rider)],
+        with_for_update={"of": RideMatch},
+    )
     if not m:
         raise HTTPException(404, "Match not found")
 
-    driver = session.exec(select(EventParticipant).where(EventParticipant.id == m.driver_participant_id)).one_or_none()
-    rider = session.exec(select(EventParticipant).where(EventParticipant.id == m.rider_participant_id)).one_or_none()
-
-    allowed = user_id in {m.created_by, (driver.user_id if driver else None), (rider.user_id if rider else None)}
+    allowed = user_id in {m.created_by, (m.driver.user_id if m.driver else None), (m.rider.user_id if m.rider else None)}
     if not allowed:
         raise HTTPException(403, "Forbidden")
 
-    if next_status == RideMatchStatus.ACCEPTED:
-        _ensure_compatible_and_seat(session, m.event_id, m.driver_participant_id, m.rider_participant_id)
+    if m.status in (RideMatchStatus.REJECTED, RideMatchStatus.CANCELED):
+        # closed matches stay closed; reviving one could clash with a newer live match
+        # for the same pair (uq_matches_active_pair), so a new proposal is needed instead
+        raise HTTPException(409, "Match is closed, propose it again")
+    if m.status == RideMatchStatus.PROPOSED:
+        await _ensure_compatible_and_seat(session, m.event_id, m.driver_participant_id, m.rider_participant_id, claim_seat=True)
+        await _take_seat(session, m.driver_participant_id)
 
     m.status = next_status
-    session.flush()
+    await session.flush()
+    invalidate_stats_on_commit(session, m.event_id)
     return m
 
-def list_matches(session: Session, event_id: UUID):
-    return session.exec(
-        select(RideMatch).where(RideMatch.event_id == event_id).order_by(RideMatch.created_at.desc())
-    ).all()
+def _matches_out_stmt(event_id: UUID):
+    # plain column rows (same fields the endpoint already returned), no ORM instances
+    return (
+        select(
+            RideMatch.id,
+            RideMatch.event_id,
+            RideMatch.driver_participant_id,
+            RideMatch.rider_participant_id,
+            RideMatch.status,
+            RideMatch.created_by,
+            RideMatch.created_at,
+            RideMatch.updated_at,
+        )
+        .where(RideMatch.event_id == event_id)
+        .order_by(RideMatch.created_at.desc(), RideMatch.id.desc())
+    )
 
-def suggestions(session: Session, event_id: UUID):
-    drivers = session.exec(
-        select(EventParticipant)
+async def list_matches(session: AsyncSession, event_id: UUID, limit: int = 100, after: tuple[datetime, UUID] | None = None):
+    stmt = _matches_out_stmt(event_id).limit(limit)
+    if after:
+        stmt = stmt.where(tuple_(RideMatch.created_at, RideMatch.id) < after)
+    return (await session.exec(stmt)).mappings().all()
+
+async def export_matches(session: AsyncSession, event_id: UUID):
+    # server-side cursor fetched yield_per rows at a time, written out as NDJSON as it goes
+    result = await session.stream(_matches_out_stmt(event_id).execution_options(yield_per=500))
+
+    async def lines():
+        async for row in result.mappings():
+            yield orjson.dumps(dict(row)) + b"\n"
+
+    return lines()
+
+async def suggestions(session: AsyncSession, event_id: UUID):
+    # greedy pairing done in SQL: each driver is expanded into one row per free seat,
+    # drivers and riders are numbered in join order, and slot n is paired with rider n
+    free_seats = EventParticipant.seats_offered - EventParticipant.seats_taken
+    slot = func.generate_series(1, free_seats).table_valued("n").render_derived().lateral("slot")
+    driver_slots = (
+        select(
+            EventParticipant.id.label("driver_id"),
+            func.row_number().over(
+                order_by=(EventParticipant.created_at, EventParticipant.id, slot.c.n)
+            ).label("rn"),
+        )
+        .select_from(EventParticipant)
+        .join(slot, true())
         .where(
             EventParticipant.event_id == event_id,
             EventParticipant.status == ParticipationStatus.APPROVED,
             EventParticipant.ride_mode == RideMode.OFFER,
         )
-        .order_by(EventParticipant.created_at.asc())
-    ).all()
-
-    riders = session.exec(
-        select(EventParticipant)
+        .cte("driver_slots")
+    )
+    riders = (
+        select(
+            EventParticipant.id.label("rider_id"),
+            func.row_number().over(order_by=(EventParticipant.created_at, EventParticipant.id)).label("rn"),
+        )
         .where(
             EventParticipant.event_id == event_id,
             EventParticipant.status == ParticipationStatus.APPROVED,
             EventParticipant.ride_mode == RideMode.NEED,
         )
-        .order_by(EventParticipant.created_at.asc())
-    ).all()
-
-    out = []
-    rider_idx = 0
-    for d in drivers:
-        accepted = _accepted_count(session, event_id, d.id)
-        remaining = d.seats_offered - accepted
-        while remaining > 0 and rider_idx < len(riders):
-            out.append({
-                "driver_participant_id": str(d.id),
-                "rider_participant_id": str(riders[rider_idx].id),
-            })
-            remaining -= 1
-            rider_idx += 1
-        if rider_idx >= len(riders):
-            break
-    return out
-
+        # riders past the last free seat can never be paired, so stop reading there
+        .order_by(EventParticipant.created_at, EventParticipant.id)
+        .limit(select(func.count()).select_from(driver_slots).scalar_subquery())
+        .cte("riders")
+    )
+    pairs = (await session.exec(
+        select(driver_slots.c.driver_id, riders.c.rider_id)
+        .join_from(driver_slots, riders, driver_slots.c.rn == riders.c.rn)
+        .order_by(driver_slots.c.rn)
+    )).all()
+    return [
+        {"driver_participant_id": str(driver_id), "rider_participant_id": str(rider_id)}
+        for driver_id, rider_id in pairs
+    ]
@@ -0,0 +1,84 @@
+import os
+import asyncio
+import logging
+from sqlalchemy import MetaData, Table, Column, Integer, Uuid, text
+
+logger = logging.getLogger(__name__)
+
+# Pre-computed per-event stats. Refreshed CONCURRENTLY on an interval; each refresh
+# re-aggregates every event, so keep the interval long. Readers see view rows at most
+# one interval (+ refresh time) old; events a worker has just written to are read live
+# by that worker until the view has caught up (see event_stats).
+STATS_MV_REFRESH_SECONDS = float(os.getenv("STATS_MV_REFRESH_SECONDS", "60"))
+
+# separate metadata: the view is created by the DDL below, not by create_all
+_views = MetaData()
+
+event_stats_mv = Table(
+    "event_stats_mv", _views,
+    Column("event_id", Uuid, primary_key=True),
+    Column("approved_count", Integer),
+    Column("pending_count", Integer),
+    Column("rejected_count", Integer),
+    Column("canceled_count", Integer),
+    Column("need_ride_count", Integer),
+    Column("offer_ride_count", Integer),
+    Column("seats_offered_total", Integer),
+    Column("seats_accepted_total", Integer),
+    Column("unmatched_riders_count", Integer),
+)
+
+EVENT_STATS_MV_DDL = [
+    """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS event_stats_mv AS
+    SELECT
+        e.id AS event_id,
+        count(ep.id) FILTER (WHERE ep.status = 'APPROVED')::int AS approved_count,
+        count(ep.id) FILTER (WHERE ep.status = 'PENDING')::int AS pending_count,
+        count(ep.id) FILTER (WHERE ep.status = 'REJECTED')::int AS rejected_count,
+        count(ep.id) FILTER (WHERE ep.status = 'CANCELED')::int AS canceled_count,
+        count(ep.id) FILTER (WHERE ep.status = 'APPROVED' AND ep.ride_mode = 'NEED')::int AS need_ride_count,
+        count(ep.id) FILTER (WHERE ep.status = 'APPROVED' AND ep.ride_mode = 'OFFER')::int AS offer_ride_count,
+        coalesce(sum(ep.seats_offered) FILTER (WHERE ep.status = 'APPROVED' AND ep.ride_mode = 'OFFER'), 0)::int AS seats_offered_total,
+        coalesce(max(m.accepted), 0)::int AS seats_accepted_total,
+        count(ep.id) FILTER (
+            WHERE ep.status = 'APPROVED' AND ep.ride_mode = 'NEED'
+            AND NOT EXISTS (
+                SELECT 1 FROM ride_matches rm
+                WHERE rm.event_id = e.id AND rm.status = 'ACCEPTED' AND rm.rider_participant_id = ep.id
+            )
+        )::int AS unmatched_riders_count
+    FROM events e
+    LEFT JOIN event_participants ep ON ep.event_id = e.id
+    LEFT JOIN (
+        SELECT event_id, count(*) AS accepted
+        FROM ride_matches
+        WHERE status = 'ACCEPTED'
+        GROUP BY event_id
+    ) m ON m.event_id = e.id
+    GROUP BY e.id
+    """,
+    # unique index is required for REFRESH ... CONCURRENTLY
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_event_stats_mv_event ON event_stats_mv (event_id)",
+]
+
+async def create_event_stats_view(conn):
+    for ddl in EVENT_STATS_MV_DDL:
+        await conn.execute(text(ddl))
+
+async def refresh_event_stats(conn) -> bool:
+    # one refresher at a time across workers; the others skip this round
+    locked = await conn.scalar(text("SELECT pg_try_advisory_xact_lock(hashtext('event_stats_mv'))"))
+    if not locked:
+        return False
+    await conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY event_stats_mv"))
+    return True
+
+async def refresh_event_stats_forever(engine):
+    while True:
+        await asyncio.sleep(STATS_MV_REFRESH_SECONDS)
+        try:
+            async with engine.begin() as conn:
+                await refresh_event_stats(conn)
+        except Exception:
+            logger.exception("event_stats_mv refresh failed")
\ No newline at end of file